@@ -1,35 +1,84 @@
 from typing import Tuple
+import asyncio
+import aiohttp
+import numpy as np
 import pandas as pd
-import requests
-from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
-import json
+from urllib.parse import urlparse
+import orjson
+import zstandard as zstd
+import re
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle, PageBreak
 from reportlab.lib.units import inch
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.lib import colors
-import urllib3
 
-# Suppress only the single InsecureRequestWarning from urllib3 needed to remove the SSL warnings
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+try:
+    from rustpy_xlsxwriter import FastExcel
+except ImportError:
+    FastExcel = None
+
+logger = logging.getLogger(__name__)
+
+# Working links checked within CACHE_FRESH_AGE are trusted as is; up to
+# CACHE_REVALIDATE_AGE they are revalidated with a conditional request
+CACHE_FRESH_AGE = timedelta(hours=24)
+CACHE_REVALIDATE_AGE = timedelta(days=7)
+
+# An igshid query parameter with its value and trailing '&', and the '?' or '&'
+# left dangling before the fragment or end of the URL once it is removed
+IGSHID_PARAM_RE = re.compile(r'(?<=[?&])igshid=[^&#]*&?')
+DANGLING_SEPARATOR_RE = re.compile(r'[?&](?=#|$)')
+
+# Number of links checked at the same time overall and per host, which also size the connection pool
+MAX_CONCURRENT_CHECKS = 500
+MAX_CHECKS_PER_HOST = 5
+
+# Seconds to wait for a TCP connection and for each read; dead hosts fail on the
+# short connect timeout while slow but live servers get the longer read timeout
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 10
+
+# Rows per table in the PDF's detailed link status section
+DETAIL_ROWS_PER_TABLE = 200
+
+# Server errors that are retried, how many times, and the base backoff in seconds
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+RETRY_TOTAL = 2
+RETRY_BACKOFF = 0.3
 
 def load_dataframe(file_path: str) -> pd.DataFrame:
     """Load a DataFrame from a given file path (CSV or XLSX)."""
     if file_path.endswith('.xlsx'):
-        df = pd.read_excel(file_path)
+        try:
+            df = pd.read_excel(file_path, engine='calamine')
+        except (ImportError, ValueError):
+            # python-calamine is not installed or pandas predates the engine
+            df = pd.read_excel(file_path)
     elif file_path.endswith('.csv'):
         df = pd.read_csv(file_path)
     else:
         raise ValueError("Unsupported file type. Please use a CSV or XLSX file.")
     return df
 
-def save_dataframe(df: pd.DataFrame, file_path: str):
+def save_dataframe(df: pd.DataFrame, file_path: str, sheet_name: str = 'Sheet1'):
     """Save a DataFrame to a specified file path (CSV or XLSX)."""
     if file_path.endswith('.xlsx'):
-        df.to_excel(file_path, index=False)
+        if FastExcel is not None:
+            try:
+                FastExcel(file_path).sheet(sheet_name, df).save()
+                return
+            except (RuntimeError, TypeError, ValueError) as e:
+                # FastExcel rejects some values openpyxl handles, such as blank dates in mixed columns
+                # or cells longer than Excel's string limit
+                logger.warning("FastExcel could not write %s, falling back to openpyxl: %s", file_path, e)
+        df.to_excel(file_path, index=False, sheet_name=sheet_name)
     elif file_path.endswith('.csv'):
         df.to_csv(file_path, index=False)
     else:
@@ -37,97 +86,115 @@ def save_dataframe(df: pd.DataFrame, file_path: str):
 
 def update_links_to_https(df: pd.DataFrame, column_name: str) -> pd.DataFrame:
     """Update http links to https in a specified column of a DataFrame."""
-    counter = 0
-    for index, link in df[column_name].items():
-        if isinstance(link, str):
-            if link.startswith('//'):
-                updated_link = 'https:' + link
-                df.at[index, column_name] = updated_link
-                counter += 1
-                print(f"Row {index + 1}: {link} -> {updated_link}")
-            if link.startswith('http://'):
-                updated_link = link.replace('http://', 'https://')
-                df.at[index, column_name] = updated_link
-                counter += 1
-                print(f"Row {index + 1}: {link} -> {updated_link}")
+    links = df[column_name]
+    updated = (links.str.replace(r'^//', 'https://', regex=True)
+               .str.replace(r'^http://', 'https://', regex=True)
+               .fillna(links))
+    counter = int((updated.ne(links) & links.notna()).sum())
+    df[column_name] = updated
     print(f"Total links updated from http to https: {counter}")
     return df
 
-def read_links(df: pd.DataFrame, column_name: str) -> Tuple[list, pd.DataFrame]:
-    """Read and return a list of links from a specified column of a DataFrame."""
-    links = df[column_name].dropna().tolist()
+def read_links(df: pd.DataFrame, column_name: str) -> Tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+    """Read and return the row indices and links from a specified column of a DataFrame."""
+    column = df[column_name].dropna()
+    indices = column.index.to_numpy()
+    links = column.to_numpy(dtype=object)
     print(f"Total links read from column: {len(links)}")
-    return links, df
+    return indices, links, df
+
+def make_cache_entry(status, response_headers=None):
+    """Build a verified links cache entry stamped with the current time."""
+    response_headers = response_headers or {}
+    return {
+        "status": status,
+        "etag": response_headers.get("ETag"),
+        "last_modified": response_headers.get("Last-Modified"),
+        "checked_at": datetime.now().isoformat(),
+    }
 
-def check_link_status(link, index, verified_links, status_codes, df, column_name, test_websites):
-    """Check the status of a given link and update the DataFrame accordingly."""
-    if link in verified_links and verified_links[link] == "Working":
-        return "Working", 200
+def cache_age(entry):
+    """Return how long ago a working link was last checked, or None if it has to be fully rechecked."""
+    if not entry or entry.get("status") != "Working" or not entry.get("checked_at"):
+        return None
+    return datetime.now() - datetime.fromisoformat(entry["checked_at"])
+
+async def request_link(session, method, link, headers):
+    """Request a link without reading its body, retrying transient server errors with backoff."""
+    for attempt in range(RETRY_TOTAL + 1):
+        if attempt:
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+        async with session.request(method, link, headers=headers, allow_redirects=True, ssl=False) as response:
+            if method == 'GET':
+                # Only the status line and headers are needed, so drop the connection before any body is read
+                response.close()
+            if response.status not in RETRY_STATUS_CODES or attempt == RETRY_TOTAL:
+                return response
+
+async def check_link_status(session, link, index, verified_links, test_websites):
+    """Check the status of a given link and return its status, status code and cache entry."""
+    cached = verified_links.get(link)
+    age = cache_age(cached)
+    if age is not None and age < CACHE_FRESH_AGE:
+        # No request is made, so report the hit as "cached" rather than an HTTP status code
+        return "Working", "cached", cached
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
         'Accept-Language': 'en-US,en;q=0.5',
+        'Accept-Encoding': 'gzip, deflate, br',
         'Referer': 'https://www.google.com'
     }
+    if age is not None and age < CACHE_REVALIDATE_AGE:
+        # Revalidate recently working links so unchanged pages answer with a bare 304
+        if cached.get("etag"):
+            headers['If-None-Match'] = cached["etag"]
+        if cached.get("last_modified"):
+            headers['If-Modified-Since'] = cached["last_modified"]
     try:
-        response = requests.get(link, headers=headers, allow_redirects=True, timeout=20, verify=False)
-        status_code = response.status_code
-        status_codes[status_code] = status_codes.get(status_code, 0) + 1
+        # HEAD skips the response body; fall back to GET for servers that do not support it
+        response = await request_link(session, 'HEAD', link, headers)
+        if response.status in (405, 501):
+            response = await request_link(session, 'GET', link, headers)
+        status_code = response.status
         if status_code == 200:
-            verified_links[link] = "Working"
-            return "Working", status_code
+            status = "Working"
+        elif status_code == 304 and cached:
+            # Unchanged since the cached check; only possible after a conditional request
+            return "Working", status_code, {**cached, "checked_at": datetime.now().isoformat()}
         elif status_code == 406:
-            print(f"Row {index + 1}: Non-200 status code for {link}: {response.status_code} - Not Acceptable")
-            verified_links[link] = "Not Working"
-            df.at[index, column_name] = ""
-            return "Not Working", status_code
+            logger.debug("Row %d: Non-200 status code for %s: %d - Not Acceptable", index + 1, link, status_code)
+            status = "Not Working"
         elif status_code == 404:
             shortened_link = shorten_url(link)
             if shortened_link == link or not test_websites:
-                print(f"Row {index + 1}: Non-200 status code for {link}: {response.status_code} - Not Found")
-                df.at[index, column_name] = ""
-                verified_links[link] = "Not Working"
-                return "Not Working", status_code
+                logger.debug("Row %d: Non-200 status code for %s: %d - Not Found", index + 1, link, status_code)
+                status = "Not Working"
             else:
-                return check_link_status(shortened_link, index, verified_links, status_codes, df, column_name, test_websites)
+                status, status_code, _ = await check_link_status(session, shortened_link, index, verified_links, test_websites)
+                return status, status_code, make_cache_entry(status)
         elif status_code == 429:
-            verified_links[link] = "Working"
-            return "Working", response.status_code
+            status = "Working"
         elif status_code == 403:
-            if test_websites:
-                verified_links[link] = "Working"
-                return "Working", status_code
-            else:
-                verified_links[link] = "Not Working"
-                df.at[index, column_name] = ""
-                return "Not Working", status_code
+            status = "Working" if test_websites else "Not Working"
         else:
-            verified_links[link] = "Not Working"
-            df.at[index, column_name] = ""
-            return "Not Working", status_code
-    except requests.exceptions.RequestException as e:
-        print(f"Row {index + 1}: Error checking {link}: {e}")
-        status_codes[0] = status_codes.get(0, 0) + 1
-        df.at[index, column_name] = ""
-        verified_links[link] = "Not Working"
-        return "Not Working", 0
-
-def remove_igshid_parameter(df: pd.DataFrame, column_name: str) -> pd.DataFrame:
-    """Remove the 'igshid' parameter from Instagram links in a specified column of a DataFrame."""
-    counter = 0
-    for index, link in df[column_name].items():
-        if isinstance(link, str):
-            parsed_url = urlparse(link)
-            query_params = parse_qs(parsed_url.query)
-            if 'igshid' in query_params:
-                del query_params['igshid']
-                new_query = urlencode(query_params, doseq=True)
-                new_url = urlunparse(parsed_url._replace(query=new_query))
-                df.at[index, column_name] = new_url
-                counter += 1
-                print(f"Row {index + 1}: {link} -> {new_url}")
-    print(f"Total links with igshid parameter removed: {counter}")
-    return df
+            status = "Not Working"
+        return status, status_code, make_cache_entry(status, response.headers if status_code == 200 else None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, TypeError, ValueError) as e:
+        # TypeError and ValueError cover cells that are not valid URLs, such as numbers
+        logger.debug("Row %d: Error checking %s: %s", index + 1, link, e)
+        return "Not Working", 0, make_cache_entry("Not Working")
+
+def remove_igshid_parameter(df: pd.DataFrame, column_name: str) -> Tuple[pd.DataFrame, int]:
+    """Remove the 'igshid' parameter from Instagram links in a specified column of a DataFrame and return how many were removed."""
+    links = df[column_name]
+    matched = links.str.contains(IGSHID_PARAM_RE, na=False)
+    updated = (links[matched].str.replace(IGSHID_PARAM_RE, '', regex=True)
+               .str.replace(DANGLING_SEPARATOR_RE, '', regex=True))
+    df.loc[matched, column_name] = updated
+    removed_count = int(matched.sum())
+    print(f"Total links with igshid parameter removed: {removed_count}")
+    return df, removed_count
 
 def shorten_url(link):
     """Shorten a URL to its base URL."""
@@ -135,7 +202,7 @@ def shorten_url(link):
     base_url = f"{parsed_url.scheme}://{parsed_url.netloc}/"
     return base_url
 
-def generate_pdf_report(file_path, sheet_name, column_name, working_count, not_working_count, removed_count, total_count, status_codes, detailed_results):
+def generate_pdf_report(file_path, sheet_name, column_name, working_count, not_working_count, removed_count, total_count, status_codes, failed_results):
     """Generate a PDF report of the link checking results."""
     # Define custom colors
     primary_color = colors.Color(103/255, 200/255, 117/255)
@@ -208,11 +275,16 @@ def generate_pdf_report(file_path, sheet_name, column_name, working_count, not_w
 
     elements.append(PageBreak())
 
-    # Detailed Link Status
-    elements.append(Paragraph('Detailed Link Status', heading_style))
-    data = [['Link', 'Status', 'Status Code']] + [[Paragraph(link, cell_style), status, status_code] for link, status, status_code in detailed_results]
-    table = Table(data, colWidths=[4*inch, 1*inch, 1*inch])
-    table.setStyle(TableStyle([
+    # Detailed status of the links that are not working
+    elements.append(Paragraph('Links Not Working', heading_style))
+    link_width = 4*inch - 12  # Column width minus the default cell padding
+    # Only links too wide for the column need a wrapping Paragraph; the rest stay plain strings
+    link_cells = [
+        Paragraph(escape(link), cell_style) if stringWidth(link, cell_style.fontName, cell_style.fontSize) > link_width else link
+        for link in failed_results['link'].astype(str)
+    ]
+    rows = [list(row) for row in zip(link_cells, failed_results['status'], failed_results['status_code'])]
+    detail_style = TableStyle([
         ('BACKGROUND', (0, 0), (-1, 0), secondary_color),
         ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
         ('ALIGN', (0, 0), (0, -1), 'LEFT'),
@@ -224,86 +296,115 @@ def generate_pdf_report(file_path, sheet_name, column_name, working_count, not_w
         ('TEXTCOLOR', (0, 1), (-1, -1), secondary_color),
         ('GRID', (0, 0), (-1, -1), 1, primary_color),
         ('WORDWRAP', (0, 0), (-1, -1), 'CJK')  # Enable word wrap
-    ]))
-    elements.append(table)
+    ])
+    # Lay out the rows as a series of small tables so layout cost stays bounded per table
+    for start in range(0, max(len(rows), 1), DETAIL_ROWS_PER_TABLE):
+        table = Table([['Link', 'Status', 'Status Code']] + rows[start:start + DETAIL_ROWS_PER_TABLE], colWidths=[4*inch, 1*inch, 1*inch], repeatRows=1)
+        table.setStyle(detail_style)
+        elements.append(table)
 
     doc.build(elements)
 
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
 file_path = 'POI DB links.xlsx'
 sheet_name = 'Copy of POI DB - POI_Data_'
 column_name = 'Website'
 test_websites = True
 
-datetime_title = datetime.now().strftime("%m-%d_%H:%M")
-
-json_file = f'verified_{column_name}_links_{datetime_title}.json'
+json_file = f'verified_{column_name}_links.json.zst'
 
 # Load previously verified links
 if os.path.exists(json_file):
-    with open(json_file, 'r') as file:
-        verified_links = json.load(file)
+    with open(json_file, 'rb') as file:
+        verified_links = orjson.loads(zstd.ZstdDecompressor().decompress(file.read()))
 else:
     verified_links = {}
 
 print("\n--------- Step 1: Update http to https in the file ---------\n")
 df = load_dataframe(file_path)
 df = update_links_to_https(df, column_name)
-save_dataframe(df, file_path)
 print(f"Updated links in {column_name}")
 
 print("\n--------- Step 2: Remove igshid parameter from Instagram links ---------\n")
-df = remove_igshid_parameter(df, column_name)
-save_dataframe(df, file_path)
+df, removed_count = remove_igshid_parameter(df, column_name)
 print(f"Removed igshid parameters from {column_name}")
 
 print("\n--------- Step 3: Read links from the updated file ---------\n")
-links, df = read_links(df, column_name)
+indices, links, df = read_links(df, column_name)
 
-print("\n--------- Step 4: Check the status of each link using threading ---------\n")
-working_count = 0
-not_working_count = 0
-removed_count = df[column_name].str.contains('igshid').sum()
-status_codes = {}
+print("\n--------- Step 4: Check the status of each link asynchronously ---------\n")
 detailed_results = []
 
-def process_link(index, link):
+async def process_link(session, index, link):
     """Process each link to check its status and update results."""
     try:
-        status, status_code = check_link_status(link, index, verified_links, status_codes, df, column_name, test_websites)
+        status, status_code, cache_entry = await check_link_status(session, link, index, verified_links, test_websites)
     except Exception as e:
-        status, status_code = "Error", 0
-        print(f"Row {index + 1}: Error processing link {link}: {e}")
+        status, status_code, cache_entry = "Error", 0, None
+        logger.error("Row %d: Error processing link %s: %s", index + 1, link, e)
+    return index, link, status, status_code, cache_entry
+
+async def check_all_links(indexed_links, concurrency=MAX_CONCURRENT_CHECKS, per_host=MAX_CHECKS_PER_HOST):
+    """Check every link over one shared connection pool, capping in-flight checks overall and per host."""
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    # Accept header lines up to 64 KB, as requests does, so sites sending large CSP or cookie headers still parse
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, max_line_size=65536, max_field_size=65536) as session:
+        slots = asyncio.Semaphore(concurrency)
+        host_slots = defaultdict(lambda: asyncio.Semaphore(per_host))
+
+        async def check(index, link):
+            # Wait for a slot on the link's host before taking a global one, so links
+            # queued behind a busy host never hold up links to other hosts
+            async with host_slots[urlparse(str(link)).netloc], slots:
+                return await process_link(session, index, link)
+
+        return await asyncio.gather(*[check(index, link) for index, link in indexed_links])
+
+# Check each distinct link once, reporting it against the first row it appears in
+unique_links = {}
+for index, link in zip(indices, links):
+    unique_links.setdefault(link, index)
+results = asyncio.run(check_all_links((index, link) for link, index in unique_links.items()))
+
+link_status = {}
+for index, link, status, status_code, cache_entry in results:
+    if cache_entry is not None and isinstance(link, str):
+        verified_links[link] = cache_entry
     detailed_results.append([link, status, status_code])
-    return link, status
+    link_status[link] = status
+status_codes = Counter(status_code for _, _, status_code in detailed_results if status_code != "cached")
 
-with ThreadPoolExecutor(max_workers=10) as executor:
-    future_to_link = {executor.submit(process_link, df.index[df[column_name] == link].tolist()[0], link): link for link in links}
-    for future in as_completed(future_to_link):
-        try:
-            link, status = future.result()
-        except Exception as e:
-            link, status = "Unknown", "Error"
-            print(f"Error in future result: {e}")
-        if status == 'Working':
-            working_count += 1
-        else:
-            not_working_count += 1
+# Broadcast the per-link results back to every row holding that link
+working_links = {link for link, status in link_status.items() if status == 'Working'}
+failed_links = {link for link, status in link_status.items() if status == 'Not Working'}
+working_count = int(df[column_name].isin(working_links).sum())
+not_working_count = len(links) - working_count
+df.loc[df[column_name].isin(failed_links), column_name] = ""
 
 print("\n--------- Results ---------\n")
 
-print(f"Total links checked: {len(links)}")
+print(f"Total links checked: {len(links)} ({len(unique_links)} unique)")
 print(f"Working links: {working_count}")
 print(f"Not working links: {not_working_count}")
 
-# Save the verified links to JSON file
-with open(json_file, 'w') as file:
-    json.dump(verified_links, file)
+# Save the verified links to a zstd-compressed JSON file
+with open(json_file, 'wb') as file:
+    file.write(zstd.ZstdCompressor(level=3).compress(orjson.dumps(verified_links)))
 
 # Save the updated DataFrame back to the file
-save_dataframe(df, file_path)
+save_dataframe(df, file_path, sheet_name)
 print(f"Updated file saved at {file_path}")
 
+# Save the full results as CSV, since the PDF report only lists the links that are not working
+results_df = pd.DataFrame(detailed_results, columns=['link', 'status', 'status_code'])
+results_file = f'{column_name}_results_{datetime.now().strftime("%m-%d_%H:%M")}.csv'
+results_df.to_csv(results_file, index=False)
+print(f"Detailed results saved at {results_file}")
+
 # Generate PDF report
-generate_pdf_report(file_path, sheet_name, column_name, working_count, not_working_count, removed_count, len(links), status_codes, detailed_results)
+failed_results = results_df[results_df['status'] != 'Working']
+generate_pdf_report(file_path, sheet_name, column_name, working_count, not_working_count, removed_count, len(links), status_codes, failed_results)
 
 print("PDF report generated successfully.")